@@ -1,21 +1,28 @@
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, HttpUrl
 import os
 import asyncio
 import aiohttp
 import ssl
-from urllib.parse import urlparse
+import socket
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, List, Optional
 import re
+from cachetools import TTLCache
+
+from app.parsing import parse_seo_elements, warm_up
 
 app = FastAPI(
     title="SEO Audit Tool",
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -27,6 +34,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SSL context shared by all outgoing requests (built once at import)
+SSL_CONTEXT = ssl.create_default_context()
+SSL_CONTEXT.check_hostname = False
+SSL_CONTEXT.verify_mode = ssl.CERT_NONE
+
+# Connection pool sizing - limit_per_host stops repeated audits of one
+# site from monopolising the pool (tune using /metrics)
+HTTP_POOL_LIMIT = 200
+HTTP_POOL_LIMIT_PER_HOST = 8
+
+# Shared HTTP session - pooled connections are reused across audits
+@app.on_event("startup")
+async def startup_http_session():
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=30,
+        enable_cleanup_closed=True,
+        ttl_dns_cache=300,
+        ssl=SSL_CONTEXT
+    )
+    app.state.http = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=10),
+        headers={'User-Agent': 'Mozilla/5.0 (compatible; SEOAuditBot/1.0)'}
+    )
+
+@app.on_event("shutdown")
+async def shutdown_http_session():
+    await app.state.http.close()
+
+# HTML parsing is CPU-bound - run it in worker processes so the event
+# loop keeps serving other requests meanwhile
+def parse_worker_count() -> int:
+    """PARSE_WORKERS if set, else the CPUs this process may run on"""
+    configured = os.environ.get('PARSE_WORKERS')
+    if configured:
+        return max(1, int(configured))
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def create_parse_pool(max_workers: int) -> tuple:
+    """Create the parse pool and start all of its workers
+    
+    Returns the pool and the futures of the start-up tasks. Each worker
+    runs parsing.warm_up (importing app.parsing and lxml) before taking
+    work, so no audit pays that cost.
+    """
+    # Never fork: the resolver threads of the running app could leave
+    # locks held in the child
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # Import the parsing module once in the server; workers fork from it
+        context.set_forkserver_preload(['app.parsing'])
+    else:
+        context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=warm_up)
+    # Workers are spawned on demand - one task per worker starts them all now
+    started = [pool.submit(os.getpid) for _ in range(max_workers)]
+    return pool, started
+
+@app.on_event("startup")
+async def startup_parse_pool():
+    app.state.pool, started = create_parse_pool(parse_worker_count())
+    await asyncio.gather(*map(asyncio.wrap_future, started))
+
+@app.on_event("shutdown")
+async def shutdown_parse_pool():
+    app.state.pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_parse_pool(func, *args):
+    """Run a module-level (picklable) function in the parse worker pool"""
+    loop = asyncio.get_running_loop()
+    pool = app.state.pool
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A worker died (crash, OOM kill) - replace the pool and retry once.
+        # Concurrent callers may get here too; only the first rebuilds.
+        if app.state.pool is pool:
+            app.state.pool, _ = create_parse_pool(parse_worker_count())
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await loop.run_in_executor(app.state.pool, func, *args)
+
 # Pydantic models
 class SEOAnalysisRequest(BaseModel):
     url: HttpUrl
@@ -61,7 +153,8 @@ async def root():
         "endpoints": {
             "seo_analyze": "POST /api/seo/analyze",
             "geo_analyze": "POST /api/geo/analyze", 
-            "traffic_estimate": "POST /api/traffic/estimate"
+            "traffic_estimate": "POST /api/traffic/estimate",
+            "metrics": "GET /metrics"
         }
     }
 
@@ -73,134 +166,213 @@ async def health_check():
         status_code=200
     )
 
+# Connection pool saturation - reads aiohttp connector internals
+@app.get("/metrics")
+async def metrics():
+    connector = app.state.http.connector
+    idle = getattr(connector, '_conns', {})
+    acquired_per_host = getattr(connector, '_acquired_per_host', {})
+    return {
+        "http_pool": {
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "acquired": len(getattr(connector, '_acquired', ())),
+            "idle": sum(len(conns) for conns in idle.values()),
+            "hosts": {
+                f"{key.host}:{key.port}": {
+                    "acquired": len(acquired_per_host.get(key, ())),
+                    "idle": len(idle.get(key, ()))
+                }
+                for key in set(idle) | set(acquired_per_host)
+            }
+        }
+    }
+
+# Host part of a bare domain or URL
+_DOMAIN_RE = re.compile(r'^(?:https?://)?([^/:?#]+)', re.IGNORECASE)
+
 # Real SEO Analysis functionality
+# SEO metadata lives near the top of the page - don't download more than this
+MAX_HTML_BYTES = 512 * 1024
+
+# Pages declaring a larger Content-Length are rejected outright
+MAX_DECLARED_BYTES = 5_000_000
+
 async def fetch_page_content(url: str) -> tuple:
-    """Fetch page content and return HTML + response time"""
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
+    """Fetch a 200 HTML page and return raw HTML bytes, response time,
+    whether the body was truncated, the page size in bytes and the
+    charset declared in the Content-Type header (or None)
     
+    Reading stops after MAX_HTML_BYTES.
+    """
     start_time = asyncio.get_event_loop().time()
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url, 
-                ssl=ssl_context,
-                timeout=aiohttp.ClientTimeout(total=10),
-                headers={'User-Agent': 'Mozilla/5.0 (compatible; SEOAuditBot/1.0)'}
-            ) as response:
-                html = await response.text()
-                load_time = (asyncio.get_event_loop().time() - start_time) * 1000
-                return html, response.status, load_time
+        async with app.state.http.get(url) as response:
+            # Don't download what we can't (or shouldn't) audit
+            if response.status != 200:
+                raise HTTPException(status_code=400, detail=f"URL returned status code {response.status}")
+            content_type = response.headers.get('Content-Type', '')
+            if content_type and 'html' not in content_type.lower():
+                raise HTTPException(status_code=415, detail=f"Unsupported content type {content_type}")
+            if (response.content_length or 0) > MAX_DECLARED_BYTES:
+                raise HTTPException(status_code=413, detail="Page too large")
+            
+            # Raw bytes - decoded by the parser using the header charset,
+            # or libxml2's own detection when there is none
+            html = bytearray()
+            truncated = False
+            async for chunk in response.content.iter_chunked(16384):
+                remaining = MAX_HTML_BYTES - len(html)
+                if len(chunk) > remaining:
+                    chunk = chunk[:remaining]
+                    truncated = True
+                html += chunk
+                if truncated:
+                    break
+            load_time = (asyncio.get_event_loop().time() - start_time) * 1000
+            
+            # Size of the whole page, not just the part we read - the
+            # declared length is exact when the body isn't content-encoded
+            byte_length = len(html)
+            if response.content_length and 'Content-Encoding' not in response.headers:
+                byte_length = max(byte_length, response.content_length)
+            
+            return bytes(html), load_time, truncated, byte_length, response.charset
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {str(e)}")
 
-def parse_seo_elements(html: str, base_url: str) -> dict:
-    """Parse HTML and extract SEO elements"""
-    from bs4 import BeautifulSoup
-    
-    soup = BeautifulSoup(html, 'html.parser')
-    parsed_base = urlparse(base_url)
-    base_domain = parsed_base.netloc
-    
-    # Title
-    title_tag = soup.find('title')
-    title = title_tag.get_text(strip=True) if title_tag else None
-    
-    # Meta description
-    meta_desc = soup.find('meta', attrs={'name': 'description'})
-    meta_description = meta_desc.get('content') if meta_desc else None
-    
-    # Headings
-    headings = {
-        'h1': [h.get_text(strip=True) for h in soup.find_all('h1')],
-        'h2': [h.get_text(strip=True) for h in soup.find_all('h2')],
-        'h3': [h.get_text(strip=True) for h in soup.find_all('h3')]
-    }
-    
-    # Images without alt text
-    images = soup.find_all('img')
-    images_without_alt = len([img for img in images if not img.get('alt')])
-    
-    # Links
-    links = soup.find_all('a', href=True)
-    internal_links = 0
-    external_links = 0
-    
-    for link in links:
-        href = link['href']
-        if href.startswith('http'):
-            if base_domain in href:
-                internal_links += 1
-            else:
-                external_links += 1
-        elif href.startswith('/') or not href.startswith('#'):
-            internal_links += 1
-    
-    # SSL check
-    has_ssl = base_url.startswith('https')
-    
-    return {
-        'title': title,
-        'meta_description': meta_description,
-        'headings': headings,
-        'images_without_alt': images_without_alt,
-        'internal_links': internal_links,
-        'external_links': external_links,
-        'has_ssl': has_ssl
-    }
+# Recommendation messages
+_RECS = {
+    'MISSING_TITLE': "❌ Missing page title - Add a descriptive <title> tag",
+    'TITLE_TOO_LONG': "⚠️ Title too long (>60 chars) - May be truncated in search results",
+    'TITLE_TOO_SHORT': "⚠️ Title too short - Consider adding more descriptive keywords",
+    'MISSING_META': "❌ Missing meta description - Add a compelling meta description",
+    'META_TOO_LONG': "⚠️ Meta description too long (>160 chars)",
+    'MISSING_H1': "❌ Missing H1 tag - Add one main H1 heading",
+    'MULTIPLE_H1': "⚠️ Multiple H1 tags - Consider using only one H1 per page",
+    'IMAGES_WITHOUT_ALT': "⚠️ %d images missing alt text - Add descriptive alt attributes",
+    'NO_SSL': "❌ No SSL certificate - Migrate to HTTPS for better rankings",
+    'LOW_INTERNAL_LINKS': "💡 Low internal linking - Add more internal links to improve navigation",
+    'ALL_GOOD': "✅ Great job! No major SEO issues found.",
+    'TRUNCATED': "ℹ️ Page exceeds %d KB - only the first %d KB were audited" % (MAX_HTML_BYTES // 1024, MAX_HTML_BYTES // 1024),
+}
 
 def generate_recommendations(data: dict) -> List[str]:
     """Generate SEO recommendations based on analysis"""
     recommendations = []
     
     if not data['title']:
-        recommendations.append("❌ Missing page title - Add a descriptive <title> tag")
+        recommendations.append(_RECS['MISSING_TITLE'])
     elif len(data['title']) > 60:
-        recommendations.append("⚠️ Title too long (>60 chars) - May be truncated in search results")
+        recommendations.append(_RECS['TITLE_TOO_LONG'])
     elif len(data['title']) < 30:
-        recommendations.append("⚠️ Title too short - Consider adding more descriptive keywords")
+        recommendations.append(_RECS['TITLE_TOO_SHORT'])
     
     if not data['meta_description']:
-        recommendations.append("❌ Missing meta description - Add a compelling meta description")
+        recommendations.append(_RECS['MISSING_META'])
     elif len(data['meta_description']) > 160:
-        recommendations.append("⚠️ Meta description too long (>160 chars)")
+        recommendations.append(_RECS['META_TOO_LONG'])
     
     h1_count = len(data['headings']['h1'])
     if h1_count == 0:
-        recommendations.append("❌ Missing H1 tag - Add one main H1 heading")
+        recommendations.append(_RECS['MISSING_H1'])
     elif h1_count > 1:
-        recommendations.append("⚠️ Multiple H1 tags - Consider using only one H1 per page")
+        recommendations.append(_RECS['MULTIPLE_H1'])
     
     if data['images_without_alt'] > 0:
-        recommendations.append(f"⚠️ {data['images_without_alt']} images missing alt text - Add descriptive alt attributes")
+        recommendations.append(_RECS['IMAGES_WITHOUT_ALT'] % data['images_without_alt'])
     
     if not data['has_ssl']:
-        recommendations.append("❌ No SSL certificate - Migrate to HTTPS for better rankings")
+        recommendations.append(_RECS['NO_SSL'])
     
     if data['internal_links'] < 3:
-        recommendations.append("💡 Low internal linking - Add more internal links to improve navigation")
+        recommendations.append(_RECS['LOW_INTERNAL_LINKS'])
     
     if not recommendations:
-        recommendations.append("✅ Great job! No major SEO issues found.")
+        recommendations.append(_RECS['ALL_GOOD'])
+    
+    if data.get('truncated'):
+        recommendations.append(_RECS['TRUNCATED'])
     
     return recommendations
 
-def calculate_seo_score(data: dict) -> int:
-    """Calculate SEO score from 0-100"""
+def score_features(has_title: bool, has_meta: bool, h1_count: int,
+                   images_without_alt: int, has_ssl: bool, internal_links: int) -> int:
+    """Scoring kernel over plain scalar features"""
     score = 100
     
-    if not data['title']: score -= 15
-    if not data['meta_description']: score -= 10
-    if len(data['headings']['h1']) != 1: score -= 10
-    if data['images_without_alt'] > 0: score -= min(data['images_without_alt'] * 2, 20)
-    if not data['has_ssl']: score -= 20
-    if data['internal_links'] < 3: score -= 5
+    if not has_title: score -= 15
+    if not has_meta: score -= 10
+    if h1_count != 1: score -= 10
+    if images_without_alt > 0: score -= min(images_without_alt * 2, 20)
+    if not has_ssl: score -= 20
+    if internal_links < 3: score -= 5
     
     return max(0, score)
 
-@app.post("/api/seo/analyze", response_model=SEOAnalysisResponse)
+def calculate_seo_score(data: dict) -> int:
+    """Calculate SEO score from 0-100"""
+    return score_features(
+        bool(data['title']),
+        bool(data['meta_description']),
+        len(data['headings']['h1']),
+        data['images_without_alt'],
+        data['has_ssl'],
+        data['internal_links']
+    )
+
+# Result caches - page analyses are stable for minutes, geo lookups for days
+_analysis_cache = TTLCache(maxsize=4096, ttl=600)
+_geo_cache = TTLCache(maxsize=4096, ttl=86400)
+_inflight: Dict[tuple, asyncio.Future] = {}
+_MISSING = object()
+
+async def cached_call(cache: TTLCache, key: str, compute):
+    """Return cache[key], computing it at most once across concurrent callers"""
+    # Single lookup - the entry could expire between 'in' and '[]'
+    hit = cache.get(key, _MISSING)
+    if hit is not _MISSING:
+        return hit
+    
+    inflight_key = (id(cache), key)
+    task = _inflight.get(inflight_key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        _inflight[inflight_key] = task
+        
+        def _store(done: asyncio.Future):
+            _inflight.pop(inflight_key, None)
+            if not done.cancelled() and done.exception() is None:
+                cache[key] = done.result()
+        
+        task.add_done_callback(_store)
+    
+    # Shield so one cancelled client doesn't abort the shared fetch
+    return await asyncio.shield(task)
+
+async def run_analysis(url_str: str) -> dict:
+    """Fetch, parse and score a page"""
+    html, load_time, truncated, byte_length, charset = await fetch_page_content(url_str)
+    
+    seo_data = await run_in_parse_pool(parse_seo_elements, html, url_str, charset)
+    seo_data['load_time_ms'] = round(load_time, 2)
+    seo_data['truncated'] = truncated
+    seo_data['content_length'] = byte_length
+    seo_data['recommendations'] = generate_recommendations(seo_data)
+    seo_data['score'] = calculate_seo_score(seo_data)
+    
+    return seo_data
+
+async def analyze_url(url_str: str) -> dict:
+    """Cached page analysis shared by the SEO and traffic endpoints"""
+    return await cached_call(_analysis_cache, url_str.rstrip('/'), lambda: run_analysis(url_str))
+
+# SEOAnalysisResponse documents the schema only - the dict is built here
+# and serialized by orjson without re-validation
+@app.post("/api/seo/analyze", response_model=None, responses={200: {"model": SEOAnalysisResponse}})
 async def analyze_seo(request: SEOAnalysisRequest):
     """
     Perform comprehensive SEO analysis on a URL
@@ -208,20 +380,11 @@ async def analyze_seo(request: SEOAnalysisRequest):
     url_str = str(request.url)
     
     try:
-        html, status_code, load_time = await fetch_page_content(url_str)
-        
-        if status_code != 200:
-            raise HTTPException(status_code=400, detail=f"URL returned status code {status_code}")
-        
-        seo_data = parse_seo_elements(html, url_str)
-        seo_data['load_time_ms'] = round(load_time, 2)
+        seo_data = await analyze_url(url_str)
         
-        recommendations = generate_recommendations(seo_data)
-        score = calculate_seo_score(seo_data)
-        
-        return {
+        return ORJSONResponse({
             "url": url_str,
-            "score": score,
+            "score": seo_data['score'],
             "title": seo_data['title'],
             "meta_description": seo_data['meta_description'],
             "headings": seo_data['headings'],
@@ -230,48 +393,68 @@ async def analyze_seo(request: SEOAnalysisRequest):
             "external_links": seo_data['external_links'],
             "has_ssl": seo_data['has_ssl'],
             "load_time_ms": seo_data['load_time_ms'],
-            "recommendations": recommendations
-        }
+            "recommendations": seo_data['recommendations']
+        })
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+async def lookup_location(host: str) -> dict:
+    """Get geolocation data for a host or IP (using ip-api.com free tier)"""
+    async with app.state.http.get(
+        f"http://ip-api.com/json/{host}",
+        timeout=aiohttp.ClientTimeout(total=5)
+    ) as geo_response:
+        return await geo_response.json(content_type=None)
+
+async def run_geo_analysis(domain: str) -> dict:
+    """Resolve a domain and look up its server location"""
+    # ip-api resolves hostnames itself, so DNS and geo lookups run concurrently
+    loop = asyncio.get_running_loop()
+    dns_task = asyncio.ensure_future(loop.getaddrinfo(domain, None, family=socket.AF_INET))
+    geo_task = asyncio.ensure_future(lookup_location(domain))
+    try:
+        addr_info, geo_data = await asyncio.gather(dns_task, geo_task)
+    except Exception:
+        geo_task.cancel()
+        # Report an unresolvable domain as such, even if the geo lookup failed first
+        await dns_task
+        raise
+    except BaseException:
+        dns_task.cancel()
+        geo_task.cancel()
+        raise
+    ip_address = addr_info[0][4][0]
+    
+    return {
+        "domain": domain,
+        "ip_address": ip_address,
+        "location": {
+            "country": geo_data.get("country"),
+            "region": geo_data.get("regionName"),
+            "city": geo_data.get("city"),
+            "zip": geo_data.get("zip"),
+            "lat": geo_data.get("lat"),
+            "lon": geo_data.get("lon"),
+            "timezone": geo_data.get("timezone"),
+            "isp": geo_data.get("isp")
+        },
+        "status": "success"
+    }
+
 @app.post("/api/geo/analyze")
 async def analyze_geo(request: GeoAnalysisRequest):
     """
     Analyze geographic/server location of a domain
     """
-    import socket
-    import requests
-    
     try:
-        # Remove protocol if present
-        domain = request.domain.replace('https://', '').replace('http://', '').split('/')[0]
-        
-        # Get IP address
-        ip_address = socket.gethostbyname(domain)
+        # Remove protocol, path and port if present
+        m = _DOMAIN_RE.match(request.domain)
+        domain = m.group(1) if m else request.domain
         
-        # Get geolocation data (using ip-api.com free tier)
-        geo_response = requests.get(f"http://ip-api.com/json/{ip_address}", timeout=5)
-        geo_data = geo_response.json()
-        
-        return {
-            "domain": domain,
-            "ip_address": ip_address,
-            "location": {
-                "country": geo_data.get("country"),
-                "region": geo_data.get("regionName"),
-                "city": geo_data.get("city"),
-                "zip": geo_data.get("zip"),
-                "lat": geo_data.get("lat"),
-                "lon": geo_data.get("lon"),
-                "timezone": geo_data.get("timezone"),
-                "isp": geo_data.get("isp")
-            },
-            "status": "success"
-        }
+        return await cached_call(_geo_cache, domain.lower(), lambda: run_geo_analysis(domain))
     except socket.gaierror:
         raise HTTPException(status_code=400, detail=f"Could not resolve domain: {request.domain}")
     except Exception as e:
@@ -286,9 +469,8 @@ async def estimate_traffic(request: TrafficEstimateRequest):
     url_str = str(request.url)
     
     try:
-        # Fetch basic page data
-        html, status_code, load_time = await fetch_page_content(url_str)
-        seo_data = parse_seo_elements(html, url_str)
+        # Fetch basic page data (shared with /api/seo/analyze)
+        seo_data = await analyze_url(url_str)
         
         # Heuristic estimation based on SEO factors
         # This is a simplified model for demonstration
@@ -298,11 +480,11 @@ async def estimate_traffic(request: TrafficEstimateRequest):
         domain_age_factor = 50  # Placeholder
         
         # Content volume estimation
-        content_length = len(html)
+        content_length = seo_data['content_length']
         pages_estimated = max(1, content_length // 50000)  # Rough estimate
         
         # SEO quality factor
-        seo_score = calculate_seo_score(seo_data)
+        seo_score = seo_data['score']
         
         # Estimate monthly visits (very rough heuristic)
         estimated_monthly_visits = (pages_estimated * 100) * (seo_score / 100) * (domain_age_factor / 50)
@@ -329,17 +511,19 @@ async def estimate_traffic(request: TrafficEstimateRequest):
             "note": "For accurate traffic data, integrate with SimilarWeb, SEMrush, or Ahrefs APIs"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Traffic estimation failed: {str(e)}")
 
-# Railway deployment configuration
+# Railway deployment configuration (locally: cd backend && python -m app.main)
 if __name__ == "__main__":
     import uvicorn
     # Railway sets PORT env var, default to 8000 for local dev
     port = int(os.environ.get("PORT", 8000))
     # Railway requires 0.0.0.0 binding
     uvicorn.run(
-        "main:app",  # Use string reference for proper reload support
+        "app.main:app",  # Use string reference for proper reload support
         host="0.0.0.0",
         port=port,
         log_level="info",
@@ -0,0 +1,153 @@
+"""HTML parsing for SEO audits
+
+Kept free of FastAPI/aiohttp imports: it runs in the parse worker
+processes, which should only have to load lxml.
+"""
+import codecs
+import re
+from functools import lru_cache
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from lxml import etree
+
+# Host of an absolute http(s) link (see classify_links)
+_ABS_HREF_RE = re.compile(r'https?://([^/?#]+)', re.IGNORECASE)
+
+# In-document encoding declarations: <meta charset> or http-equiv Content-Type
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+_BOMS = (codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+# Heading texts returned per level (h1/h2/h3)
+MAX_HEADINGS_PER_LEVEL = 10
+
+def make_pull_parser(encoding: Optional[str] = None) -> etree.HTMLPullParser:
+    """HTML pull parser decoding with the given charset when libxml2 knows it"""
+    if encoding:
+        # libxml2 rejects some Python aliases (e.g. latin-1) - retry with
+        # Python's canonical codec name
+        try:
+            names = (encoding, codecs.lookup(encoding).name)
+        except LookupError:
+            names = (encoding,)
+        for name in names:
+            try:
+                return etree.HTMLPullParser(events=('end',), encoding=name)
+            except LookupError:
+                pass
+    return etree.HTMLPullParser(events=('end',))
+
+class SEOElementCollector:
+    """Parse HTML (whole or in chunks) and accumulate SEO elements in a single pass"""
+    
+    def __init__(self, encoding: Optional[str] = None):
+        self.title = None
+        self.meta_description = None
+        self.headings = {'h1': [], 'h2': [], 'h3': []}
+        self.images_without_alt = 0
+        self.hrefs = []
+        self._parser = make_pull_parser(encoding)
+    
+    def feed(self, data: bytes) -> None:
+        """Feed a chunk of raw HTML and record any completed elements"""
+        self._parser.feed(data)
+        self._read_events()
+    
+    def close(self, base_url: str) -> dict:
+        """Finish parsing and return the SEO data dict"""
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError:
+            # Empty document
+            pass
+        self._read_events()
+        return self.result(base_url)
+    
+    def _read_events(self) -> None:
+        for _, el in self._parser.read_events():
+            self._handle(el)
+    
+    def _handle(self, el) -> None:
+        """Record a single (fully parsed) element"""
+        tag = el.tag
+        if tag == 'a':
+            href = el.get('href')
+            if href is not None:
+                self.hrefs.append(href)
+        elif tag == 'img':
+            if not el.get('alt'):
+                self.images_without_alt += 1
+        elif tag in self.headings:
+            texts = self.headings[tag]
+            # Counts only matter as 0 / 1 / many, so the text list is bounded
+            if len(texts) < MAX_HEADINGS_PER_LEVEL:
+                texts.append(''.join(el.itertext()).strip())
+        elif tag == 'title':
+            # Only the first <title> counts
+            if self.title is None:
+                self.title = ''.join(el.itertext()).strip()
+        elif tag == 'meta':
+            if self.meta_description is None and el.get('name') == 'description':
+                self.meta_description = el.get('content')
+    
+    def result(self, base_url: str) -> dict:
+        """Build the SEO data dict for the collected elements"""
+        internal_links, external_links = classify_links(self.hrefs, url_netloc(base_url))
+        
+        return {
+            'title': self.title or None,
+            'meta_description': self.meta_description,
+            'headings': self.headings,
+            'images_without_alt': self.images_without_alt,
+            'internal_links': internal_links,
+            'external_links': external_links,
+            'has_ssl': base_url.startswith('https')
+        }
+
+@lru_cache(maxsize=1024)
+def url_netloc(url: str) -> str:
+    """Cached urlparse(url).netloc - the same URLs are audited repeatedly"""
+    return urlparse(url).netloc
+
+def classify_links(hrefs: List[str], base_domain: str) -> tuple:
+    """Count internal and external links relative to base_domain"""
+    internal_links = 0
+    external_links = 0
+    subdomain_suffix = '.' + base_domain
+    
+    for href in hrefs:
+        # Dispatch on the first character - only absolute links need the regex
+        first = href[:1]
+        if first == '#':
+            # Fragment-only anchors are not counted
+            continue
+        if first == 'h' or first == 'H':
+            m = _ABS_HREF_RE.match(href)
+            if m is not None:
+                host = m.group(1).lower()
+                if host == base_domain or host.endswith(subdomain_suffix):
+                    internal_links += 1
+                else:
+                    external_links += 1
+                continue
+        # Root-relative or relative path
+        internal_links += 1
+    
+    return internal_links, external_links
+
+def declares_encoding(html: bytes) -> bool:
+    """Whether the document itself names its encoding (BOM or <meta> in the first 1 KB)"""
+    return html.startswith(_BOMS) or _META_CHARSET_RE.search(html, 0, 1024) is not None
+
+def parse_seo_elements(html: bytes, base_url: str, encoding: Optional[str] = None) -> dict:
+    """Parse a complete HTML document and extract SEO elements"""
+    if encoding is None and not declares_encoding(html):
+        # Same fallback as aiohttp's response.text() - libxml2 would guess Latin-1
+        encoding = 'utf-8'
+    collector = SEOElementCollector(encoding)
+    collector.feed(html)
+    return collector.close(base_url)
+
+def warm_up() -> None:
+    """Parse worker initializer - load lxml and this module before the first audit"""
+    parse_seo_elements(b'', '')
@@ -0,0 +1,2 @@
+# Makes the backend directory importable so tests can `from app import main`
+# whether pytest is run from here or from the repository root
@@ -0,0 +1,197 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from aiohttp import web
+from cachetools import TTLCache
+from fastapi import HTTPException
+
+from app import main, parsing
+
+
+def serve_and_fetch(body: bytes, content_type: str, status: int = 200) -> tuple:
+    """Serve body from a local aiohttp server and fetch it with fetch_page_content"""
+    async def run():
+        async def handler(request):
+            return web.Response(body=body, status=status, headers={'Content-Type': content_type})
+
+        server = web.Application()
+        server.router.add_get('/', handler)
+        runner = web.AppRunner(server)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        await main.startup_http_session()
+        try:
+            return await main.fetch_page_content(f'http://127.0.0.1:{port}/')
+        finally:
+            await main.shutdown_http_session()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_header_charset_is_used_for_decoding():
+    body = '<html><head><title>Café</title></head><body><h1>Über</h1></body></html>'.encode('utf-8')
+
+    html, _, _, _, charset = serve_and_fetch(body, 'text/html; charset=utf-8')
+    seo_data = parsing.parse_seo_elements(html, 'http://example.com/', charset)
+
+    assert charset == 'utf-8'
+    assert seo_data['title'] == 'Café'
+    assert seo_data['headings']['h1'] == ['Über']
+
+
+def test_undeclared_charset_defaults_to_utf8():
+    html = '<html><head><title>Café</title></head><body><h1>Über</h1></body></html>'.encode('utf-8')
+
+    seo_data = parsing.parse_seo_elements(html, 'http://example.com/', None)
+
+    assert seo_data['title'] == 'Café'
+    assert seo_data['headings']['h1'] == ['Über']
+
+
+def test_meta_charset_is_used_without_header_charset():
+    html = '<html><head><meta charset="iso-8859-1"><title>Café</title></head></html>'.encode('latin-1')
+
+    assert parsing.parse_seo_elements(html, 'http://example.com/', None)['title'] == 'Café'
+
+
+def test_python_only_charset_alias_is_accepted():
+    html = '<title>Café</title>'.encode('latin-1')
+
+    assert parsing.parse_seo_elements(html, 'http://example.com/', 'latin-1')['title'] == 'Café'
+
+
+def test_body_end_inside_script_does_not_stop_download():
+    body = (
+        b"<html><head><script>var tpl = '<p></p></body>';</script></head><body>"
+        + b'<p>filler</p>' * 7000
+        + b'<h1>Heading</h1><a href="/a">a</a><a href="/b">b</a><a href="/c">c</a></body></html>'
+    )
+
+    html, _, truncated, _, charset = serve_and_fetch(body, 'text/html')
+    seo_data = parsing.parse_seo_elements(html, 'http://example.com/', charset)
+
+    assert html == body
+    assert not truncated
+    assert seo_data['headings']['h1'] == ['Heading']
+    assert seo_data['internal_links'] == 3
+
+
+def test_parse_pool_recovers_from_dead_worker():
+    async def run():
+        await main.startup_parse_pool()
+        try:
+            broken = main.app.state.pool
+            # Kill a worker - every later submission to this pool fails
+            with pytest.raises(BrokenProcessPool):
+                await asyncio.get_running_loop().run_in_executor(broken, os._exit, 1)
+
+            seo_data = await main.run_in_parse_pool(
+                parsing.parse_seo_elements, b'<title>Recovered</title>', 'http://example.com/'
+            )
+            assert main.app.state.pool is not broken
+            return seo_data
+        finally:
+            await main.shutdown_parse_pool()
+
+    assert asyncio.run(run())['title'] == 'Recovered'
+
+
+def test_error_status_is_rejected_before_download():
+    with pytest.raises(HTTPException) as exc_info:
+        serve_and_fetch(b'<html><body>Not found</body></html>', 'text/html', status=404)
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == 'URL returned status code 404'
+
+
+@pytest.mark.parametrize('href, expected', [
+    ('#frag', (0, 0)),
+    ('/path', (1, 0)),
+    ('relative', (1, 0)),
+    ('mailto:someone@example.com', (1, 0)),
+    ('HTTP://EXAMPLE.com/page', (1, 0)),
+    ('https://example.com', (1, 0)),
+    ('https://sub.example.com/page', (1, 0)),
+    ('https://notexample.com/', (0, 1)),
+    ('https://other.com/?ref=example.com', (0, 1)),
+])
+def test_classify_links(href, expected):
+    assert parsing.classify_links([href], 'example.com') == expected
+
+
+def test_cached_call_shares_one_computation():
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {'calls': calls}
+
+    async def run():
+        cache = TTLCache(maxsize=8, ttl=60)
+        results = await asyncio.gather(*(main.cached_call(cache, 'k', compute) for _ in range(5)))
+        cached = await main.cached_call(cache, 'k', compute)
+        return results, cached
+
+    results, cached = asyncio.run(run())
+
+    assert calls == 1
+    assert results == [{'calls': 1}] * 5
+    assert cached == {'calls': 1}
+
+
+def test_cached_call_does_not_cache_failures():
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise HTTPException(status_code=400, detail='boom')
+        return 'ok'
+
+    async def run():
+        cache = TTLCache(maxsize=8, ttl=60)
+        failures = await asyncio.gather(
+            *(main.cached_call(cache, 'k', compute) for _ in range(3)), return_exceptions=True
+        )
+        return failures, 'k' in cache, await main.cached_call(cache, 'k', compute)
+
+    failures, cached_after_failure, retried = asyncio.run(run())
+
+    assert all(isinstance(f, HTTPException) for f in failures)
+    assert not cached_after_failure
+    assert retried == 'ok'
+    assert calls == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_computation():
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    async def run():
+        cache = TTLCache(maxsize=8, ttl=60)
+        first = asyncio.ensure_future(main.cached_call(cache, 'k', compute))
+        second = asyncio.ensure_future(main.cached_call(cache, 'k', compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return first, await second, cache.get('k')
+
+    first, second_result, cached = asyncio.run(run())
+
+    assert first.cancelled()
+    assert second_result == 'done'
+    assert cached == 'done'
+    assert calls == 1